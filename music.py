@@ -3,12 +3,35 @@ import numpy as np
 import pandas as pd
 import networkx as nx
 import plotly.graph_objects as go
-import time
 import random
-import pygame.midi
-import pygame.mixer
 from midiutil.MidiFile import MIDIFile
-import os
+import io
+import wave
+import functools
+
+try:
+    from numba import njit
+except ImportError:  # fall back to the plain Python loop
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# Compiled lazily: streamlit re-executes this module on every rerun, but the
+# cached composer keeps calling the first run's _walk, so only its first call
+# compiles (or loads from the disk cache)
+@njit(cache=True)
+def _walk(nbrs_flat, nbrs_offsets, nbrs_cum, start, draws):
+    # Random walk over the per-note cumulative neighbor weights, one uniform
+    # draw per step
+    out = np.empty(draws.shape[0], dtype=np.int32)
+    state = start
+    for i in range(draws.shape[0]):
+        out[i] = state
+        lo = nbrs_offsets[state]
+        hi = nbrs_offsets[state + 1]
+        state = nbrs_flat[lo + np.searchsorted(nbrs_cum[lo:hi], draws[i], side='right')]
+    return out
 
 class MusicComposer:
     def __init__(self):
@@ -18,72 +41,79 @@ class MusicComposer:
         }
         self.octaves = [4, 5]
         self.durations = [0.25, 0.5, 1]
-        self.graph = self._create_note_graph()
-        
-    def _create_note_graph(self):
-        G = nx.DiGraph()
-        for octave in self.octaves:
-            for note in self.notes:
-                G.add_node(f"{note}{octave}")
+        self.nodes = [f"{note}{octave}" for octave in self.octaves for note in self.notes]
+        self._nbrs_flat, self._nbrs_offsets, self._nbrs_weights = self._create_note_edges()
+        self._nbrs_cum = self._create_cum_weights()
+        self._midi = np.array([self.note_to_midi_number(note) for note in self.nodes], dtype=np.int16)
         
-        for octave in self.octaves:
-            for i, note in enumerate(self.notes):
-                next_idx = (i + 1) % len(self.notes)
-                prev_idx = (i - 1) % len(self.notes)
-                
-                G.add_edge(f"{note}{octave}", f"{self.notes[next_idx]}{octave}", weight=0.7)
-                G.add_edge(f"{note}{octave}", f"{self.notes[prev_idx]}{octave}", weight=0.7)
-                
-                for other_octave in self.octaves:
-                    if other_octave != octave:
-                        G.add_edge(f"{note}{octave}", f"{note}{other_octave}", weight=0.3)
+    def _create_note_edges(self):
+        # CSR-style adjacency: the neighbors of state s are
+        # _nbrs_flat[_nbrs_offsets[s]:_nbrs_offsets[s + 1]]
+        n_notes = len(self.notes)
+        flat, offsets, weights = [], [0], []
+        for o in range(len(self.octaves)):
+            for i in range(n_notes):
+                base = o * n_notes
+                flat += [base + (i + 1) % n_notes, base + (i - 1) % n_notes]
+                weights += [0.7, 0.7]
+                for other in range(len(self.octaves)):
+                    if other != o:
+                        flat.append(other * n_notes + i)
+                        weights.append(0.3)
+                offsets.append(len(flat))
         
+        return (
+            np.array(flat, dtype=np.int32),
+            np.array(offsets, dtype=np.int32),
+            np.array(weights, dtype=np.float64)
+        )
+
+    def edge_index(self):
+        # (source, target) node indices of every transition, in graph edge order
+        sources = np.repeat(np.arange(len(self.nodes), dtype=np.int32), np.diff(self._nbrs_offsets))
+        return sources, self._nbrs_flat
+
+    @functools.cached_property
+    def graph(self):
+        # Only the visualization needs a NetworkX graph, so build it on first use
+        G = nx.DiGraph()
+        G.add_nodes_from(self.nodes)
+        G.add_weighted_edges_from(
+            (self.nodes[u], self.nodes[v], w)
+            for u, v, w in zip(*self.edge_index(), self._nbrs_weights)
+        )
         return G
 
+    def _create_cum_weights(self):
+        # Normalized cumulative weights per neighbor segment, computed once.
+        # Dividing by the segment total makes each segment end at exactly 1.0,
+        # so a uniform draw in [0, 1) always lands inside it
+        cum = np.empty_like(self._nbrs_weights)
+        for lo, hi in zip(self._nbrs_offsets[:-1], self._nbrs_offsets[1:]):
+            seg = np.cumsum(self._nbrs_weights[lo:hi])
+            cum[lo:hi] = seg / seg[-1]
+        return cum
+
     def note_to_midi_number(self, note):
         note_name = note[0]
         octave = int(note[1])
         return self.note_to_midi[note_name] + (octave - 4) * 12
 
-    def generate_melody(self, length, mood):
-        melody = []
-        weights = []
-        current_note = random.choice([f"{note}{octave}" 
-                                    for note in self.notes 
-                                    for octave in self.octaves])
-        
-        mood_weights = {
-            'happy': {'weight_mul': 1.2, 'duration_pref': 0.25},
-            'sad': {'weight_mul': 0.8, 'duration_pref': 1},
-            'energetic': {'weight_mul': 1.5, 'duration_pref': 0.25},
-            'calm': {'weight_mul': 0.6, 'duration_pref': 0.5}
-        }
+    def generate_melody(self, length, mood, seed=None):
+        # The mood multiplier used to scale every edge of a note equally, so it
+        # cancelled out on normalization; the walk only depends on self._nbrs_cum
+        rng = np.random.default_rng(seed)
+        start = int(rng.integers(len(self.nodes)))
+        states = _walk(self._nbrs_flat, self._nbrs_offsets, self._nbrs_cum, start, rng.random(length))
         
-        for _ in range(length):
-            melody.append(current_note)
-            neighbors = list(self.graph.neighbors(current_note))
-            if not neighbors:
-                break
-                
-            edge_weights = [self.graph[current_note][next_note]['weight'] * 
-                        mood_weights[mood]['weight_mul']
-                        for next_note in neighbors]
-            
-            total_weight = sum(edge_weights)
-            if total_weight > 0:
-                edge_weights = [w / total_weight for w in edge_weights]
-            else:
-                edge_weights = [1.0 / len(neighbors)] * len(neighbors)
-            
-            current_note = random.choices(neighbors, weights=edge_weights)[0]
-            weights.append(random.random())
-        
-        return melody, weights
+        # MIDI pitches are the canonical representation; the note names are
+        # only kept for display
+        notes = [self.nodes[i] for i in states]
+        midi = self._midi[states]
+        weights = rng.random(length).astype(np.float32)
+        return notes, midi, weights
 
-    def generate_melody_with_midi(self, length, mood, tempo):
-        melody, weights = self.generate_melody(length, mood)
-        
-        # Create MIDI file
+    def render_midi(self, midi, tempo):
         midifile = MIDIFile(1)
         track = 0
         time_counter = 0
@@ -94,25 +124,119 @@ class MusicComposer:
         midifile.addTempo(track, time_counter, tempo)
         
         # Add notes to MIDI file
-        for note in melody:
-            midi_note = self.note_to_midi_number(note)
-            duration = 1  # Quarter note
-            midifile.addNote(track, channel, midi_note, time_counter, duration, volume)
-            time_counter += 1
+        add_note = midifile.addNote
+        duration = 1  # Quarter note
+        for time_counter, midi_note in enumerate(np.asarray(midi).tolist()):
+            add_note(track, channel, midi_note, time_counter, duration, volume)
+        
+        # Serialize in memory instead of round-tripping through a temp file
+        buf = io.BytesIO()
+        midifile.writeFile(buf)
+        return buf.getvalue()
+
+    def render_wav(self, midi, tempo, sample_rate=44100):
+        freqs = 440.0 * 2 ** ((np.asarray(midi, dtype=np.float64) - 69) / 12)
         
-        # Save MIDI file
-        midi_path = "temp_melody.mid"
-        with open(midi_path, "wb") as f:
-            midifile.writeFile(f)
+        # One quarter note per beat, synthesized for all notes at once
+        n = int(sample_rate * 60 / tempo)
+        t = np.arange(n) / sample_rate
+        envelope = np.exp(-3 * t)
+        fade = min(n // 2, int(0.005 * sample_rate))  # avoid clicks between notes
+        if fade:
+            envelope[:fade] *= np.linspace(0, 1, fade)
+            envelope[-fade:] *= np.linspace(1, 0, fade)
         
-        return melody, weights
+        phase = 2 * np.pi * freqs[:, None] * t
+        tones = (np.sin(phase) + 0.3 * np.sin(2 * phase)) / 1.3 * envelope
+        samples = (tones.ravel() * 0.8 * 32767).astype(np.int16)
+        
+        buf = io.BytesIO()
+        with wave.open(buf, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate)
+            wav.writeframes(samples.tobytes())
+        return buf.getvalue()
+
+@st.cache_resource
+def get_composer():
+    # The note graph is static, so build it once per process instead of on every rerun
+    return MusicComposer()
+
+@st.cache_data(max_entries=8)
+def generate_melody(length, mood, seed):
+    return get_composer().generate_melody(length, mood, seed)
+
+@st.cache_data(max_entries=8)
+def render_midi(midi, tempo):
+    # Keyed on the melody and tempo only, so a tempo change re-renders the
+    # MIDI without re-rolling the melody
+    return get_composer().render_midi(midi, tempo)
 
-def create_figure(melody=None, weights=None):
+@st.cache_data(max_entries=8)
+def render_wav(midi, tempo):
+    # Rendered on the server and played by the browser, so replaying the
+    # same melody at the same tempo is served from the cache
+    return get_composer().render_wav(midi, tempo)
+
+@st.cache_data
+def get_graph_layout():
+    # Seeded so the cached layout is stable across processes
+    return nx.spring_layout(get_composer().graph, seed=42)
+
+@st.cache_resource
+def build_graph_figure():
+    composer = get_composer()
+    pos = get_graph_layout()
+    
+    # Index edges straight from the composer's edge index rather than
+    # iterating the NetworkX graph edge by edge
+    nodes = composer.nodes
+    pos_arr = np.array([pos[node] for node in nodes])
+    edges = np.column_stack(composer.edge_index())
+    
+    # Each edge becomes (start, end, NaN); Plotly breaks the line at NaN
+    edge_xy = np.full((len(edges), 3, 2), np.nan)
+    edge_xy[:, :2] = np.take(pos_arr, edges, axis=0)
+    edge_x = edge_xy[:, :, 0].ravel()
+    edge_y = edge_xy[:, :, 1].ravel()
+    
+    node_x = pos_arr[:, 0]
+    node_y = pos_arr[:, 1]
+    
+    fig_graph = go.Figure()
+    fig_graph.add_trace(
+        go.Scatter(
+            x=edge_x, y=edge_y,
+            mode='lines',
+            line=dict(color='gray', width=0.5),
+            hoverinfo='none'
+        )
+    )
+    fig_graph.add_trace(
+        go.Scatter(
+            x=node_x, y=node_y,
+            mode='markers+text',
+            marker=dict(size=10),
+            text=nodes,
+            textposition='top center'
+        )
+    )
+    
+    fig_graph.update_layout(
+        showlegend=False,
+        height=400,
+        title="Note Graph Structure"
+    )
+    return fig_graph
+
+@st.cache_data(max_entries=8)
+def create_figure(midi=None, weights=None, tempo=None):
     fig = go.Figure()
     
-    if melody and weights:
-        x = list(range(len(melody)))
-        y = [ord(note[0]) + float(note[1]) * 12 for note in melody]
+    if midi is not None and len(midi) and weights is not None and len(weights):
+        x = np.arange(len(midi))
+        y = midi
         
         fig.add_trace(
             go.Scatter(
@@ -133,158 +257,103 @@ def create_figure(melody=None, weights=None):
                 name='Intensity'
             )
         )
+        
+        # Let the browser reveal the melody step by step instead of
+        # re-sending the figure from the server on every step
+        fig.frames = [
+            go.Frame(data=[go.Scatter(x=x[:i], y=y[:i]), go.Scatter(x=x[:i], y=weights[:i])])
+            for i in range(1, len(midi) + 1)
+        ]
+        # Frame duration matches the tempo: one frame per beat
+        frame_ms = 60000 / tempo if tempo else 100
+        y_min = min(y.min(), weights.min())
+        y_max = max(y.max(), weights.max())
+        fig.update_layout(
+            xaxis=dict(range=[-0.5, len(midi) - 0.5]),
+            yaxis=dict(range=[y_min - 5, y_max + 5]),
+            updatemenus=[dict(
+                type='buttons',
+                showactive=False,
+                buttons=[
+                    dict(
+                        label='▶ Play Animation',
+                        method='animate',
+                        args=[None, dict(
+                            frame=dict(duration=frame_ms, redraw=False),
+                            transition=dict(duration=0),
+                            fromcurrent=True
+                        )]
+                    ),
+                    dict(
+                        label='⏸ Pause',
+                        method='animate',
+                        args=[[None], dict(
+                            frame=dict(duration=0, redraw=False),
+                            mode='immediate'
+                        )]
+                    )
+                ]
+            )]
+        )
     
     fig.update_layout(
         title="Melody Visualization",
         xaxis_title="Time",
-        yaxis_title="Note Value",
+        yaxis_title="MIDI Pitch",
         showlegend=True,
         height=500
     )
     
     return fig
 
-def play_midi():
-    try:
-        if pygame.mixer.get_init() is None:
-            pygame.mixer.init()
-        if pygame.mixer.music.get_busy():
-            pygame.mixer.music.stop()
-        pygame.mixer.music.load("temp_melody.mid")
-        pygame.mixer.music.play()
-    except Exception as e:
-        st.error(f"Error playing audio: {str(e)}")
-
-def stop_midi():
-    try:
-        if pygame.mixer.get_init() is not None and pygame.mixer.music.get_busy():
-            pygame.mixer.music.stop()
-    except Exception as e:
-        st.error(f"Error stopping audio: {str(e)}")
+@st.fragment
+def melody_panel(tempo):
+    # Widgets in this panel only rerun the panel, not the whole page
+    midi = tuple(st.session_state.midi.tolist())
+    
+    fig = create_figure(st.session_state.midi, st.session_state.weights, tempo)
+    st.plotly_chart(fig, use_container_width=True)
+    
+    st.audio(render_wav(midi, tempo), format='audio/wav')
+    st.download_button(
+        "⬇ Download MIDI",
+        data=render_midi(midi, tempo),
+        file_name="melody.mid",
+        mime="audio/midi"
+    )
 
 def main():
     st.set_page_config(page_title="Algorithmic Music Composer", layout="wide")
     
-    # Initialize pygame
-    if 'pygame_initialized' not in st.session_state:
-        pygame.init()
-        st.session_state.pygame_initialized = True
-    
     st.title("🎵 Algorithmic Music Composer")
     
-    composer = MusicComposer()
-    
     with st.sidebar:
         st.header("Controls")
         mood = st.selectbox("Select Mood", ['happy', 'sad', 'energetic', 'calm'])
         length = st.slider("Melody Length", 8, 32, 16)
         tempo = st.slider("Tempo (BPM)", 60, 180, 120)
         
-        if st.button("Generate New Melody"):
-            stop_midi()  # Stop any playing music
-            st.session_state.melody, st.session_state.weights = composer.generate_melody_with_midi(
-                length, mood, tempo
-            )
-            st.session_state.current_pos = 0
-            st.session_state.playing = False
+        generate_clicked = st.button("Generate New Melody")
+    
+    # A new seed is only drawn on Generate (or the first render); other reruns
+    # rebuild the melody from the kept seed, which the cache serves directly
+    if generate_clicked or 'seed' not in st.session_state:
+        st.session_state.seed = random.randrange(2**32)
+    st.session_state.melody, st.session_state.midi, st.session_state.weights = generate_melody(
+        length, mood, st.session_state.seed
+    )
     
     col1, col2 = st.columns([2, 1])
     
     with col1:
-        chart_placeholder = st.empty()
-        
-        if 'melody' not in st.session_state:
-            st.session_state.melody, st.session_state.weights = composer.generate_melody_with_midi(
-                length, mood, tempo
-            )
-            st.session_state.current_pos = 0
-            st.session_state.playing = False
-        
-        # Audio and visualization controls
-        audio_col1, audio_col2, audio_col3 = st.columns(3)
-        with audio_col1:
-            play_visual = st.button("▶ Play Animation")
-        with audio_col2:
-            play_audio = st.button("🔊 Play Melody")
-        with audio_col3:
-            stop_audio = st.button("⏹ Stop")
-        
-        if play_audio:
-            play_midi()
-        if stop_audio:
-            stop_midi()
-        
-        if play_visual:
-            st.session_state.playing = True
-            st.session_state.current_pos = 0
-        
-        if st.session_state.playing:
-            while st.session_state.current_pos <= len(st.session_state.melody):
-                current_melody = st.session_state.melody[:st.session_state.current_pos]
-                current_weights = st.session_state.weights[:st.session_state.current_pos]
-                
-                fig = create_figure(current_melody, current_weights)
-                chart_placeholder.plotly_chart(fig, use_container_width=True)
-                
-                st.session_state.current_pos += 1
-                time.sleep(0.1)
-            
-            st.session_state.playing = False
-        else:
-            fig = create_figure(st.session_state.melody, st.session_state.weights)
-            chart_placeholder.plotly_chart(fig, use_container_width=True)
+        melody_panel(tempo)
     
     with col2:
         st.subheader("Current Melody")
         st.write("Notes:", ", ".join(st.session_state.melody))
         
         st.subheader("Note Transitions")
-        G = composer.graph
-        pos = nx.spring_layout(G)
-        
-        edge_x = []
-        edge_y = []
-        for edge in G.edges():
-            x0, y0 = pos[edge[0]]
-            x1, y1 = pos[edge[1]]
-            edge_x.extend([x0, x1, None])
-            edge_y.extend([y0, y1, None])
-        
-        node_x = [pos[node][0] for node in G.nodes()]
-        node_y = [pos[node][1] for node in G.nodes()]
-        
-        fig_graph = go.Figure()
-        fig_graph.add_trace(
-            go.Scatter(
-                x=edge_x, y=edge_y,
-                mode='lines',
-                line=dict(color='gray', width=0.5),
-                hoverinfo='none'
-            )
-        )
-        fig_graph.add_trace(
-            go.Scatter(
-                x=node_x, y=node_y,
-                mode='markers+text',
-                marker=dict(size=10),
-                text=list(G.nodes()),
-                textposition='top center'
-            )
-        )
-        
-        fig_graph.update_layout(
-            showlegend=False,
-            height=400,
-            title="Note Graph Structure"
-        )
-        st.plotly_chart(fig_graph, use_container_width=True)
-
-    # Cleanup on app reload
-    if os.path.exists("Romantic-Piano.mid"):
-        try:
-            os.remove("Romantic-Piano.mid")
-        except:
-            pass
+        st.plotly_chart(build_graph_figure(), use_container_width=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file